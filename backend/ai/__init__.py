@@ -1 +1,6 @@
-from .client import get_ai_client
\ No newline at end of file
+def __getattr__(name):
+    # keep `import ai` light, the client (and openai) load when first used
+    if name == "get_ai_client":
+        from .client import get_ai_client
+        return get_ai_client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
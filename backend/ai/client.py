@@ -1,14 +1,32 @@
 import os
-from openai import OpenAI
-from django.conf import settings
-from dotenv import load_dotenv
+from functools import lru_cache
+from .limits import rate_limit
 
-load_dotenv()
+# openai and dotenv are imported on first use, so importing this module (and the
+# django processes that only need prompts or limits) stays cheap
 
+@lru_cache(maxsize=None)
+def load_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# override these to point at ai/mock_server.py for load testing
+def deepseek_base_url():
+    load_env()
+    return os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+
+def docsbot_base_url():
+    load_env()
+    return os.getenv("DOCSBOT_BASE_URL", "https://docsbot.ai")
+
+# one client per process, it keeps its connection pool between calls
+@lru_cache(maxsize=None)
 def get_ai_client():
+    from openai import OpenAI
+    load_env()
     return OpenAI(
         api_key=os.getenv("DEEPSEEK_API_KEY"),
-        base_url="https://api.deepseek.com"
+        base_url=deepseek_base_url()
     )
 
 def prompt_context_summary(context):
@@ -53,6 +71,8 @@ def prompt_image_context(context):
 
 
 def ai_call(prompt):
+    # outside the try, running out of rate budget is not a failed call and is left to the caller
+    rate_limit("deepseek")
     client = get_ai_client()
     try:
         response = client.chat.completions.create(
@@ -67,4 +87,5 @@ def ai_call(prompt):
         return None
 
 def botsai():
+    load_env()
     return os.getenv("BOTSAI_API_KEY")
\ No newline at end of file
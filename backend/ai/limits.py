@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from django.conf import settings
+
+
+class RateLimited(Exception):
+    pass
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        # blocks until a token is available, returns False if it would take longer than timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def available(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queue, per_user, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.user_in_flight = defaultdict(int)
+        self.admitted = 0
+        self.rejected = defaultdict(int)
+        self.wait_times = deque(maxlen=1000)
+
+    def _reject(self, reason, retry_after=None):
+        self.rejected[reason] += 1
+        raise Rejected(reason, retry_after)
+
+    @contextmanager
+    def admit(self, key):
+        start = time.monotonic()
+        with self.cond:
+            # reject right away instead of queueing work we can't serve in time
+            if self.user_in_flight[key] >= self.per_user:
+                self._reject('user_limit')
+            if self.running >= self.max_concurrent and self.waiting >= self.max_queue:
+                self._reject('queue_full', self.queue_timeout)
+
+            self.user_in_flight[key] += 1
+            self.waiting += 1
+            admitted = self.cond.wait_for(lambda: self.running < self.max_concurrent, self.queue_timeout)
+            self.waiting -= 1
+            if not admitted:
+                self._release_user(key)
+                self._reject('queue_timeout', self.queue_timeout)
+
+            self.running += 1
+            self.admitted += 1
+            self.wait_times.append(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running -= 1
+                self._release_user(key)
+                self.cond.notify()
+
+    def _release_user(self, key):
+        self.user_in_flight[key] -= 1
+        if self.user_in_flight[key] <= 0:
+            del self.user_in_flight[key]
+
+    def metrics(self):
+        with self.cond:
+            waits = sorted(self.wait_times)
+            return {
+                'running': self.running,
+                'queue_depth': self.waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'wait_time_avg': sum(waits) / len(waits) if waits else 0.0,
+                'wait_time_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+                'wait_time_max': waits[-1] if waits else 0.0,
+            }
+
+
+DEFAULT_ADMISSION = {
+    'MAX_CONCURRENT': 4,
+    'MAX_QUEUE': 16,
+    'PER_USER': 1,
+    'QUEUE_TIMEOUT': 30,
+}
+
+# requests per second and burst size per upstream
+DEFAULT_RATE_LIMITS = {
+    'docsbot': (4, 8),
+    'deepseek': (2, 4),
+}
+
+_lock = threading.Lock()
+_admission = None
+_buckets = {}
+
+
+def get_admission():
+    global _admission
+    with _lock:
+        if _admission is None:
+            config = {**DEFAULT_ADMISSION, **getattr(settings, 'AI_ADMISSION', {})}
+            _admission = AdmissionController(
+                config['MAX_CONCURRENT'], config['MAX_QUEUE'], config['PER_USER'], config['QUEUE_TIMEOUT']
+            )
+        return _admission
+
+
+def get_bucket(upstream):
+    with _lock:
+        if upstream not in _buckets:
+            rate, capacity = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'AI_RATE_LIMITS', {})}[upstream]
+            # buckets live in this process, split the site-wide limit between the worker processes
+            workers = max(1, getattr(settings, 'AI_WORKER_PROCESSES', 1))
+            _buckets[upstream] = TokenBucket(rate / workers, max(1, capacity / workers))
+        return _buckets[upstream]
+
+
+def rate_limit(upstream, timeout=30):
+    if not get_bucket(upstream).acquire(timeout):
+        raise RateLimited(f"{upstream} rate limit wait exceeded {timeout}s")
+
+
+def metrics():
+    return {
+        'admission': get_admission().metrics(),
+        'rate_limits': {name: round(bucket.available(), 2) for name, bucket in _buckets.items()},
+    }
@@ -0,0 +1,118 @@
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# offline stand-in for docsbot's image prompter and DeepSeek's chat completions API,
+# point DOCSBOT_BASE_URL and DEEPSEEK_BASE_URL at it to load test without live services
+
+DOCSBOT_PATH = "/api/tools/image-prompter"
+CHAT_PATH = "/chat/completions"
+
+DEFAULT_RESPONSES = {
+    "docsbot": [
+        "A man standing on a street looks sadly at a hot dog lying on the ground.",
+        "A cat sits at a kitchen table staring at a plate of vegetables with disgust.",
+        "A split image: on the left a person ignores a plain option, on the right they smile at a flashy one.",
+        "A dog wearing glasses sits in front of a laptop in a messy home office.",
+    ],
+    "deepseek": [
+        "When the code works on the first try",
+        "Me pretending to listen in the meeting",
+        "Monday morning energy",
+        "Nobody:\nAbsolutely nobody:",
+    ],
+}
+
+
+def parse_latency(spec):
+    # fixed:0.2, uniform:0.1:0.5, normal:0.3:0.1, lognormal:<median>:<sigma>, exp:<mean>
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / params[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockUpstreams:
+    def __init__(self, docsbot_latency="fixed:0", deepseek_latency="fixed:0", error_rate=0.0, error_status=500, responses=None):
+        self.latency = {
+            "docsbot": parse_latency(docsbot_latency),
+            "deepseek": parse_latency(deepseek_latency),
+        }
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.responses = {**DEFAULT_RESPONSES, **(responses or {})}
+        self.lock = threading.Lock()
+        self.counts = {"docsbot": 0, "deepseek": 0, "errors": 0}
+
+    def handle(self, upstream):
+        # returns (status, content type, body) after sleeping for the sampled latency
+        time.sleep(self.latency[upstream]())
+        with self.lock:
+            self.counts[upstream] += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.counts["errors"] += 1
+        if failed:
+            return self.error_status, "application/json", json.dumps({"error": "injected failure"})
+
+        text = random.choice(self.responses[upstream])
+        if upstream == "docsbot":
+            return 200, "text/plain", text
+        return 200, "application/json", json.dumps({
+            "id": f"mock-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "deepseek-chat",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def make_server(self, host="127.0.0.1", port=8100):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.split("?")[0].rstrip("/")
+                if path == DOCSBOT_PATH:
+                    status, content_type, body = upstreams.handle("docsbot")
+                elif path.endswith(CHAT_PATH):
+                    status, content_type, body = upstreams.handle("deepseek")
+                else:
+                    status, content_type, body = 404, "application/json", json.dumps({"error": "not found"})
+                self.reply(status, content_type, body)
+
+            def do_GET(self):
+                self.reply(200, "application/json", json.dumps(upstreams.counts))
+
+            def reply(self, status, content_type, body):
+                body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ThreadingHTTPServer((host, port), Handler)
@@ -5,43 +5,94 @@ import requests
 import textwrap
 import base64
 import io
+import json
 import os
+import tempfile
+import threading
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
-from .client import prompt_image_context, ai_call, prompt_context_summary, botsai
+from .client import prompt_image_context, ai_call, prompt_context_summary, botsai, docsbot_base_url
+from .limits import rate_limit, RateLimited
 
 def generate_meme_captions(context):
+    return captions_from_summary(summarize_context(context), context)
+
+
+def summarize_context(context):
+    return ai_call(prompt_context_summary(context))
+
+
+def captions_from_summary(summary, context):
     try:
-        prompt = prompt_context_summary(context)
-        summary = ai_call(prompt)
         prompt = prompt_image_context(summary)
         content = ai_call(prompt)
         captions = [line.strip() for line in content.split('\n') if line.strip()]
         if captions:
             return captions
         return [context]
+    except RateLimited:
+        raise
     except Exception as e:
         print(f"Error generating captions: {e}")
         return [context]
 
-def load_image(image_source):
-    if image_source.startswith(('http://', 'https://')):
-        return Image.open(requests.get(image_source, stream=True).raw).convert("RGB")
-    return Image.open(image_source).convert("RGB")
+# uploads are capped to this before any processing, so memory per request stays bounded
+MAX_INPUT_SIZE = (2048, 2048)
+# encoded images above this spill from memory to a temp file
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
 
 
-def prepare_image(image_path, max_size=(800, 800), quality=85):
-    img = load_image(image_path)
-    img.thumbnail(max_size)
+def load_image(image_source, max_size=None):
+    if isinstance(image_source, Image.Image):
+        return image_source
+    if isinstance(image_source, str) and image_source.startswith(('http://', 'https://')):
+        img = Image.open(requests.get(image_source, stream=True).raw)
+    else:
+        img = Image.open(image_source)
+
+    if max_size:
+        # lets the JPEG decoder downscale while decoding instead of after. It only
+        # scales by powers of two, so allow landing a bit under the cap (e.g. 4000x3000
+        # decodes to 2000x1500) rather than decoding at full size
+        scale = min(max_size[0] / img.width, max_size[1] / img.height) * 0.75
+        if scale < 1:
+            img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+    # convert() always copies, skip it when the mode is already right
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    else:
+        img.load()
+    if max_size:
+        img.thumbnail(max_size)
+    return img
+
+
+def fit_within(img, max_size):
+    # resized copy that fits max_size, or the image itself when it already fits
+    scale = min(max_size[0] / img.width, max_size[1] / img.height)
+    if scale >= 1:
+        return img
+    return img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+
+
+def encode_image(img, format="JPEG", quality=95):
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    img.save(buffer, format=format, quality=quality)
+    buffer.seek(0)
+    return buffer
+
+
+def prepare_image(image_source, max_size=(800, 800), quality=85):
+    img = fit_within(load_image(image_source, max_size), max_size)
 
     buffer = io.BytesIO()
     img.save(buffer, format="JPEG", quality=quality)
-    buffer.seek(0)
 
-    encoded = base64.b64encode(buffer.read()).decode("utf-8")
+    encoded = base64.b64encode(buffer.getbuffer()).decode("utf-8")
     return encoded
 
 def make_caption_request(image_data):
-    url = "https://docsbot.ai/api/tools/image-prompter"
+    url = f"{docsbot_base_url().rstrip('/')}/api/tools/image-prompter"
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {botsai()}"
@@ -49,12 +100,13 @@ def make_caption_request(image_data):
     payload = {
         "image": image_data
     }
+    rate_limit("docsbot")
     response = requests.post(url, headers=headers, json=payload)
     
     return response.text
 
-def get_image_context(image_path):
-    image_data = prepare_image(image_path)
+def get_image_context(image_source):
+    image_data = prepare_image(image_source)
     
     with ThreadPoolExecutor(max_workers=4) as executor:
         futures = [executor.submit(make_caption_request, image_data) for _ in range(4)]
@@ -64,6 +116,8 @@ def get_image_context(image_path):
             try:
                 result = future.result()
                 results.append(result)
+            except RateLimited:
+                raise
             except Exception as e:
                 results.append(f"Request failed: {str(e)}")
     
@@ -72,11 +126,6 @@ def get_image_context(image_path):
 
 def find_image_regions(image_cv, min_area=5000):
     gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-    h, w = gray.shape
-    
-    grid_regions = detect_grid_layout(image_cv)
-    if grid_regions:
-        return grid_regions
     
     _, thresh = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -227,6 +276,10 @@ def assign_zones_to_captions(zones, captions, image_size):
 
 
 def fit_font_for_box(draw, text, box_w, box_h, font_path=None, height_ratio=0.6):
+    return get_scalable_font(fit_font_size_for_box(draw, text, box_w, box_h, height_ratio))
+
+
+def fit_font_size_for_box(draw, text, box_w, box_h, height_ratio=0.6):
     target_h = int(box_h * height_ratio)
     
     for size in range(target_h, 8, -2):
@@ -236,9 +289,9 @@ def fit_font_for_box(draw, text, box_w, box_h, font_path=None, height_ratio=0.6)
         text_h = bbox[3] - bbox[1]
         
         if text_w <= box_w * 0.9 and text_h <= target_h:
-            return font
+            return size
     
-    return get_scalable_font(8)
+    return 8
 
 
 def get_scalable_font(size=20):
@@ -268,13 +321,15 @@ def draw_text_with_outline(draw, pos, text, font, fill_color="black", outline_co
     draw.text((x, y), text, font=font, fill=fill_color)
 
 
-def meme_with_captions(image_path, captions, font_path=None):
-    # load image, process it and remove blank spaces
-    img = load_image(image_path)
-    cv_img = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-    processed_img = remove_blank_spaces(cv_img)
-    processed_pil = Image.fromarray(cv2.cvtColor(processed_img, cv2.COLOR_BGR2RGB))
-    cv_processed = cv2.cvtColor(np.array(processed_pil), cv2.COLOR_RGB2BGR)
+def layout_captions(img, captions):
+    # find crop box, zones and font sizes without drawing anything,
+    # so the result can be stored and rendered later on the original image
+    cv_img = np.array(img)
+    cv2.cvtColor(cv_img, cv2.COLOR_RGB2BGR, dst=cv_img)
+    left, top, right, bottom = find_content_box(cv_img)
+    # a view, not a copy
+    cv_processed = cv_img[top:bottom, left:right]
+    processed_size = (right - left, bottom - top)
     
     image_regions = detect_grid_layout(cv_processed, len(captions))
         
@@ -282,10 +337,10 @@ def meme_with_captions(image_path, captions, font_path=None):
         image_regions = find_image_regions(cv_processed)
     
     if image_regions and len(image_regions) >= len(captions):
-        zones = create_caption_zones_on_images(image_regions, processed_pil.size)
+        zones = create_caption_zones_on_images(image_regions, processed_size)
     else:
         # fallback
-        W, H = processed_pil.size
+        W, H = processed_size
         num_captions = len(captions)
         
         if W > H * 1.5:  # wide image - horizontal strips
@@ -306,13 +361,30 @@ def meme_with_captions(image_path, captions, font_path=None):
                 zones = [("fallback", 0, i * strip_height, W, strip_height) 
                         for i in range(num_captions)]
 
-    assigned = assign_zones_to_captions(zones, captions, processed_pil.size)
+    assigned = assign_zones_to_captions(zones, captions, processed_size)
+    
+    # textbbox does not depend on the image, a 1x1 canvas is enough for measuring
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    layers = []
+    for (x, y, w, h), text in assigned:
+        layers.append({
+            "text": text,
+            "zone": [int(x), int(y), int(w), int(h)],
+            "font_size": fit_font_size_for_box(draw, text, w, h),
+        })
     
-    # draw captions
+    return (left, top, right, bottom), layers
+
+
+def render_caption_layers(img, crop_box, layers):
+    # crop the original and draw stored caption layers on top of it
+    processed_pil = img.crop(tuple(crop_box)) if crop_box else img.copy()
     draw = ImageDraw.Draw(processed_pil)
     
-    for (x, y, w, h), text in assigned:
-        font = fit_font_for_box(draw, text, w, h, font_path)
+    for layer in layers:
+        x, y, w, h = layer["zone"]
+        text = layer["text"]
+        font = get_scalable_font(layer["font_size"])
         bbox = draw.textbbox((0, 0), text, font=font)
         text_w, text_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
         tx = x + (w - text_w) // 2
@@ -322,7 +394,103 @@ def meme_with_captions(image_path, captions, font_path=None):
     return processed_pil
 
 
-def remove_blank_spaces(image_cv, threshold=5):
+def meme_with_captions(image_path, captions, font_path=None):
+    img = load_image(image_path)
+    crop_box, layers = layout_captions(img, captions)
+    return render_caption_layers(img, crop_box, layers)
+
+
+RENDER_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+# widths are snapped to these so a client can't fill the cache with one entry per pixel,
+# anything wider than the largest one is served at full size
+RENDER_WIDTHS = (320, 640, 1080)
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ByteLRUCache:
+    """LRU cache of bytes values bounded by their total size instead of the entry count."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_render_cache = ByteLRUCache(RENDER_CACHE_MAX_BYTES)
+
+
+def snap_width(width):
+    if width is None:
+        return None
+    for allowed in RENDER_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return None
+
+
+def render_meme(image_path, crop_box, layers, width=None, fmt="jpeg", quality=90, opener=None):
+    # layers are lists/dicts, turn them into a stable string so they can be part of the cache key
+    layers_key = json.dumps(layers, sort_keys=True)
+    crop_key = tuple(crop_box) if crop_box else None
+    width = snap_width(width)
+    key = (image_path, crop_key, layers_key, width, fmt, quality)
+    data = _render_cache.get(key)
+    if data is None:
+        data = _render_meme(image_path, crop_key, layers_key, width, fmt, quality, opener)
+        _render_cache.set(key, data)
+    return data
+
+
+def _render_meme(image_path, crop_box, layers_key, width, fmt, quality, opener):
+    pil_format, _ = RENDER_FORMATS[fmt]
+    if opener:
+        # e.g. a storage backend's open, image_path is then a storage name
+        with opener(image_path) as f:
+            img = load_image(f)
+    else:
+        img = load_image(image_path)
+    img = render_caption_layers(img, crop_box, json.loads(layers_key))
+    
+    if width and width < img.width:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+    
+    buffer = io.BytesIO()
+    img.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+
+def find_content_box(image_cv, threshold=5):
     gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
     h, w = gray.shape
     
@@ -337,10 +505,49 @@ def remove_blank_spaces(image_cv, threshold=5):
     left = find_boundary(gray.mean(axis=0), threshold)
     right = w - find_boundary(gray.mean(axis=0), threshold, reverse=True)
     
+    return left, top, right, bottom
+
+
+def remove_blank_spaces(image_cv, threshold=5):
+    left, top, right, bottom = find_content_box(image_cv, threshold)
+    
     # return cropped content
     return image_cv[top:bottom, left:right]
 
 
+def iter_meme_stages(img):
+    # the steps of generate_meme one at a time, yielding (stage, result) as each one finishes
+    context = get_image_context(img)
+    yield "described", context
+    summary = summarize_context(context)
+    yield "summarized", summary
+    captions = captions_from_summary(summary, context)
+    crop_box, layers = layout_captions(img, captions)
+    yield "captioned", (captions, crop_box, layers)
+
+
+def render_preview(img, crop_box, layers, width=320, quality=70):
+    # small JPEG drawn on a downscaled copy, with zones and font sizes scaled to match
+    left, top, right, bottom = crop_box
+    scale = min(1, width / (right - left))
+    small = img.crop(tuple(crop_box))
+    if scale < 1:
+        small = small.resize((width, max(1, round((bottom - top) * scale))), Image.LANCZOS)
+    scaled_layers = [
+        {
+            "text": layer["text"],
+            "zone": [round(v * scale) for v in layer["zone"]],
+            "font_size": max(8, round(layer["font_size"] * scale)),
+        }
+        for layer in layers
+    ]
+    preview = render_caption_layers(small, None, scaled_layers)
+
+    buffer = io.BytesIO()
+    preview.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
 def generate_meme(image_path):
     context = get_image_context(image_path)
     captions = generate_meme_captions(context)
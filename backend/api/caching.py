@@ -0,0 +1,69 @@
+from django.core.cache import cache
+from django.db import transaction
+from .models import UserVote
+
+# per-meme fragments are invalidated precisely on change, so they can live long.
+# ranked id lists change with every vote and are only kept briefly
+FRAGMENT_TIMEOUT = 60 * 60
+USER_VOTES_TIMEOUT = 10 * 60
+FEED_IDS_TIMEOUT = 10 * 60
+RANKED_IDS_TIMEOUT = 30
+
+
+def fragment_key(meme_id):
+    return f"meme:fragment:{meme_id}"
+
+
+def user_vote_key(user_id, meme_id):
+    return f"meme:uservote:{user_id}:{meme_id}"
+
+
+def feed_ids_key(username=None):
+    return f"meme:feed-ids:user:{username}" if username else "meme:feed-ids:all"
+
+
+def get_fragments(meme_ids):
+    cached = cache.get_many([fragment_key(meme_id) for meme_id in meme_ids])
+    return {fragment['id']: fragment for fragment in cached.values()}
+
+
+def set_fragments(fragments):
+    cache.set_many({fragment_key(meme_id): fragment for meme_id, fragment in fragments.items()}, FRAGMENT_TIMEOUT)
+
+
+def get_user_votes(user_id, meme_ids):
+    # the user's votes on these memes as {meme_id: vote_type or None}, overlaid on shared
+    # fragments as userVote. Cached per meme, "no vote" as '' so it isn't a miss
+    keys = {user_vote_key(user_id, meme_id): meme_id for meme_id in meme_ids}
+    votes = {keys[key]: vote or None for key, vote in cache.get_many(keys).items()}
+    missing = [meme_id for meme_id in meme_ids if meme_id not in votes]
+    if missing:
+        loaded = dict(UserVote.objects.filter(user_id=user_id, meme_id__in=missing).values_list('meme_id', 'vote_type'))
+        cache.set_many({user_vote_key(user_id, meme_id): loaded.get(meme_id, '') for meme_id in missing}, USER_VOTES_TIMEOUT)
+        votes.update({meme_id: loaded.get(meme_id) for meme_id in missing})
+    return votes
+
+
+def get_ids(key, load, timeout=FEED_IDS_TIMEOUT):
+    ids = cache.get(key)
+    if ids is None:
+        ids = load()
+        cache.set(key, ids, timeout)
+    return ids
+
+
+# invalidation runs after commit, so a concurrent read can't cache the old rows again
+
+def invalidate_memes(meme_ids):
+    keys = [fragment_key(meme_id) for meme_id in meme_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_user_votes(user_id, meme_ids):
+    keys = [user_vote_key(user_id, meme_id) for meme_id in meme_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_feeds(username):
+    keys = [feed_ids_key(), feed_ids_key(username)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,95 @@
+from itertools import islice
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from . import caching
+from .models import Meme
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib json module
+    orjson = None
+
+# same output as MemeSerializer, built from values() rows instead of model instances
+FEED_FIELDS = ('id', 'user__username', 'image', 'image_url', 'caption', 'caption_layers', 'created_at', 'upvote', 'downvote')
+
+
+def format_datetime(value):
+    # matches rest_framework.fields.DateTimeField output for UTC datetimes
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def build_fragments(rows):
+    # the cacheable part of each item: no userVote, and urls relative to the
+    # site root (unless storage gives absolute ones) so fragments don't depend on the host
+    render_prefix, render_suffix = reverse('meme-render', kwargs={'id': 0}).rsplit('/0/', 1)
+    fragments = {}
+    for row in rows:
+        original = default_storage.url(row['image']) if row['image'] else None
+        image = original
+        if row['image'] and row['caption_layers']:
+            image = f"{render_prefix}/{row['id']}/{render_suffix}"
+
+        fragments[row['id']] = {
+            'id': row['id'],
+            'user': row['user__username'],
+            'image': image,
+            'original': original,
+            'image_url': row['image_url'],
+            'caption': row['caption'],
+            'caption_layers': row['caption_layers'],
+            'created_at': format_datetime(row['created_at']),
+            'upvote': row['upvote'],
+            'downvote': row['downvote'],
+        }
+    return fragments
+
+
+def load_fragments(meme_ids):
+    fragments = caching.get_fragments(meme_ids)
+    missing = [meme_id for meme_id in meme_ids if meme_id not in fragments]
+    if missing:
+        loaded = build_fragments(Meme.objects.filter(id__in=missing).values(*FEED_FIELDS))
+        caching.set_fragments(loaded)
+        fragments.update(loaded)
+    return fragments
+
+
+def iter_feed(request, queryset=None, ids=None, chunk_size=500):
+    base = request.build_absolute_uri('/')[:-1]
+    if ids is None:
+        ids = queryset.values_list('id', flat=True).iterator(chunk_size=chunk_size)
+
+    ids = iter(ids)
+    while chunk := list(islice(ids, chunk_size)):
+        fragments = load_fragments(chunk)
+        votes = caching.get_user_votes(request.user.id, chunk) if request.user.is_authenticated else {}
+        for meme_id in chunk:
+            fragment = fragments.get(meme_id)
+            if fragment is None:
+                # deleted since the id list was cached
+                continue
+            item = dict(fragment)
+            for field in ('image', 'original'):
+                if item[field] and item[field].startswith('/'):
+                    item[field] = base + item[field]
+            item['userVote'] = votes.get(meme_id)
+            yield item
+
+
+def serialize_feed(request, queryset=None, ids=None):
+    return list(iter_feed(request, queryset, ids))
+
+
+def iter_ndjson(request, queryset=None, ids=None):
+    for item in iter_feed(request, queryset, ids):
+        yield dumps(item) + b'\n'
@@ -0,0 +1,109 @@
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from api import caching
+from api.feed import serialize_feed, iter_ndjson
+from api.models import Meme, UserVote
+from api.renderers import FeedJSONRenderer
+from api.serializers import MemeSerializer
+
+
+class PreChangeMemeSerializer(serializers.ModelSerializer):
+    # MemeSerializer as it was before the feed work (method fields, a vote query per row), with
+    # original and caption_layers as plain fields so it gives the same output as the feed
+    user = serializers.StringRelatedField(read_only=True)
+    image = serializers.SerializerMethodField()
+    original = serializers.SerializerMethodField()
+    userVote = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Meme
+        fields = ('id', 'user', 'image', 'original', 'image_url', 'caption', 'caption_layers', 'created_at', 'upvote', 'downvote', 'userVote')
+
+    def get_image(self, obj):
+        if obj.image and obj.caption_layers:
+            return self.context['request'].build_absolute_uri(reverse('meme-render', kwargs={'id': obj.id}))
+        return self.get_original(obj)
+
+    def get_original(self, obj):
+        if obj.image and hasattr(obj.image, 'url'):
+            return self.context['request'].build_absolute_uri(obj.image.url)
+        return None
+
+    def get_userVote(self, obj):
+        request = self.context['request']
+        if request.user.is_authenticated:
+            try:
+                return UserVote.objects.get(user=request.user, meme=obj).vote_type
+            except UserVote.DoesNotExist:
+                return None
+        return None
+
+
+class Command(BaseCommand):
+    help = "Compare the pre-change MemeSerializer path with the values()-based feed path. Test rows are rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.run(size, options['repeat'])
+                transaction.set_rollback(True)
+
+    def run(self, size, repeat):
+        user = User.objects.create_user(username='bench_feed_user', password='bench')
+        Meme.objects.bulk_create(
+            Meme(
+                user=user,
+                image=f'memes/bench_{i}.jpg',
+                caption=f'bench caption {i}',
+                caption_layers=[{'text': f'bench caption {i}', 'zone': [0, 0, 100, 50], 'font_size': 20}],
+            )
+            for i in range(size)
+        )
+        request = APIRequestFactory().get('/api/memes/', HTTP_HOST='localhost')
+        request.user = user
+        queryset = Meme.objects.filter(user=user).order_by('-created_at')
+
+        def serializer_path(serializer_class):
+            data = serializer_class(queryset, many=True, context={'request': request}).data
+            return JSONRenderer().render(data)
+
+        def feed_path():
+            return FeedJSONRenderer().render(serialize_feed(request, queryset))
+
+        fragment_keys = [caching.fragment_key(meme_id) for meme_id in queryset.values_list('id', flat=True)]
+
+        def cold_feed_path():
+            cache.delete_many(fragment_keys)
+            return feed_path()
+
+        def first_ndjson_line():
+            return next(iter_ndjson(request, queryset))
+
+        self.stdout.write(f"{size} memes:")
+        baseline = self.measure('pre-change serializer + JSONRenderer', lambda: serializer_path(PreChangeMemeSerializer), repeat)
+        self.measure('current MemeSerializer + JSONRenderer', lambda: serializer_path(MemeSerializer), repeat)
+        fast = self.measure('values() feed + FeedJSONRenderer', cold_feed_path, repeat)
+        self.measure('same, fragments cached', feed_path, repeat)
+        self.measure('NDJSON time to first item', first_ndjson_line, repeat)
+        self.stdout.write(f"  speedup over the pre-change path: {baseline / fast:.1f}x")
+        cache.delete_many(fragment_keys)
+
+    def measure(self, label, func, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        self.stdout.write(f"  {label:<40} {best * 1000:9.1f} ms")
+        return best
@@ -0,0 +1,54 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# what a fresh worker does before serving its first request
+STARTUP = (
+    "import django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+HEAVY_MODULES = ('cv2', 'numpy', 'PIL', 'openai', 'requests', 'dotenv')
+
+
+class Command(BaseCommand):
+    help = "Measure worker cold-start time and list the slowest imports (python -X importtime)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help="slowest imports to list")
+        parser.add_argument('--max-ms', type=float, help="fail if the median cold start is slower than this")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        command = [sys.executable, '-c', STARTUP]
+
+        timings = []
+        for _ in range(options['runs']):
+            start = time.perf_counter()
+            subprocess.run(command, env=env, check=True)
+            timings.append((time.perf_counter() - start) * 1000)
+        median = statistics.median(timings)
+        self.stdout.write(f"Cold start: median {median:.0f} ms, min {min(timings):.0f} ms over {len(timings)} runs")
+
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP], env=env, check=True, capture_output=True, text=True)
+        imports = []
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((int(cumulative), name.rstrip()))
+
+        loaded = {name.strip().split('.')[0] for _, name in imports}
+        heavy = [module for module in HEAVY_MODULES if module in loaded]
+        self.stdout.write(f"Heavy modules loaded at startup: {', '.join(heavy) or 'none'}")
+        self.stdout.write(f"Slowest {options['top']} imports (cumulative):")
+        for cumulative, name in sorted(imports, reverse=True)[:options['top']]:
+            self.stdout.write(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+        if options['max_ms'] is not None and median > options['max_ms']:
+            raise CommandError(f"Cold start {median:.0f} ms is over the {options['max_ms']:.0f} ms budget")
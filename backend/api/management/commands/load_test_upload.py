@@ -0,0 +1,81 @@
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = "Drive /api/memes/upload/ at a target request rate and report throughput and latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('image', help="image file to upload")
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--rps', type=float, default=2.0)
+        parser.add_argument('--duration', type=float, default=30.0, help="seconds")
+        parser.add_argument('--workers', type=int, default=64, help="max requests in flight")
+
+    def handle(self, *args, **options):
+        base_url = options['url'].rstrip('/')
+        response = requests.post(f"{base_url}/api/login/", data={
+            'username': options['username'],
+            'password': options['password'],
+        })
+        if response.status_code != 200:
+            raise CommandError(f"Login failed: {response.status_code} {response.text}")
+        headers = {'Authorization': f"Bearer {response.json()['access']}"}
+
+        with open(options['image'], 'rb') as f:
+            image = f.read()
+
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def upload():
+            start = time.perf_counter()
+            try:
+                status = requests.post(
+                    f"{base_url}/api/memes/upload/",
+                    headers=headers,
+                    files={'image': ('load_test.jpg', image, 'image/jpeg')},
+                ).status_code
+            except requests.RequestException:
+                status = 'error'
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 201:
+                    latencies.append(elapsed)
+
+        # open loop: requests are scheduled at the target rate whether or not earlier ones finished
+        total = int(options['rps'] * options['duration'])
+        interval = 1 / options['rps']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for i in range(total):
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(upload)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"Sent {total} uploads in {elapsed:.1f}s (target {options['rps']} rps)")
+        self.stdout.write(f"Status codes: {dict(statuses)}")
+        self.stdout.write(f"Throughput: {len(latencies) / elapsed:.2f} successful uploads/s")
+        if latencies:
+            self.stdout.write(
+                f"Latency: p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  "
+                f"p99 {percentile(latencies, 99):.2f}s  mean {statistics.mean(latencies):.2f}s"
+            )
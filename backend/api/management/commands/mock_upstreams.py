@@ -0,0 +1,42 @@
+import json
+from django.core.management.base import BaseCommand
+from ai.mock_server import MockUpstreams
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for docsbot and DeepSeek with latency and fault injection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--docsbot-latency', default='lognormal:1.5:0.4',
+                            help="fixed:S, uniform:A:B, normal:MU:SIGMA, lognormal:MEDIAN:SIGMA or exp:MEAN, in seconds")
+        parser.add_argument('--deepseek-latency', default='lognormal:2.0:0.5')
+        parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+        parser.add_argument('--error-status', type=int, default=500)
+        parser.add_argument('--responses', help='JSON file with {"docsbot": [...], "deepseek": [...]} canned responses')
+
+    def handle(self, *args, **options):
+        responses = None
+        if options['responses']:
+            with open(options['responses'], encoding='utf-8') as f:
+                responses = json.load(f)
+
+        upstreams = MockUpstreams(
+            docsbot_latency=options['docsbot_latency'],
+            deepseek_latency=options['deepseek_latency'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            responses=responses,
+        )
+        server = upstreams.make_server(options['host'], options['port'])
+        base_url = f"http://{options['host']}:{options['port']}"
+        self.stdout.write(f"Mock upstreams on {base_url}, start the backend with:")
+        self.stdout.write(f"  DOCSBOT_BASE_URL={base_url} DEEPSEEK_BASE_URL={base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served: {upstreams.counts}")
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from api.models import Meme
+from api.scoring import hot_score, wilson_score
+
+
+class Command(BaseCommand):
+    help = ("Recompute denormalized meme scores in primary key batches. Votes keep scores current, "
+            "run this after changing the scoring formulas or to backfill existing rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--since-days', type=int, help="only memes created in the last N days")
+
+    def handle(self, *args, **options):
+        queryset = Meme.objects.all()
+        if options['since_days']:
+            queryset = queryset.filter(created_at__gte=timezone.now() - timedelta(days=options['since_days']))
+
+        bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write("No memes to update.")
+            return
+
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        updated = 0
+        # walk id ranges instead of OFFSET so each batch is an index range scan
+        for low in range(bounds['low'], bounds['high'] + 1, batch_size):
+            rows = queryset.filter(id__gte=low, id__lt=low + batch_size).values_list('id', 'upvote', 'downvote', 'created_at', 'score', 'hot')
+            changed = []
+            for meme_id, upvote, downvote, created_at, score, hot in rows:
+                new_score = wilson_score(upvote, downvote)
+                new_hot = hot_score(upvote, downvote, created_at)
+                if new_score != score or new_hot != hot:
+                    changed.append(Meme(id=meme_id, score=new_score, hot=new_hot))
+            if changed:
+                with transaction.atomic():
+                    Meme.objects.bulk_update(changed, ['score', 'hot'], batch_size=1000)
+                updated += len(changed)
+
+        self.stdout.write(f"Updated {updated} memes in {time.perf_counter() - start:.1f}s")
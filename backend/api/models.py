@@ -1,18 +1,47 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .scoring import hot_score, wilson_score
 
 class Meme(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='memes')
     image = models.ImageField(upload_to='memes/', blank=True, null=True)
     image_url = models.URLField(blank=True, null=True)
     caption = models.TextField(blank=True, null=True)
+    # original image stays untouched, captions are rendered on demand from these
+    crop_box = models.JSONField(blank=True, null=True)
+    caption_layers = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     upvote = models.IntegerField(default=0)
     downvote = models.IntegerField(default=0)
+    # denormalized from the vote counts so feeds can be served from an index
+    score = models.FloatField(default=0)
+    hot = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-hot', '-id'], name='meme_hot_idx'),
+            models.Index(fields=['-score', '-id'], name='meme_score_idx'),
+            models.Index(fields=['-created_at'], name='meme_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.caption[:20] if self.caption else ''}"
 
+    def update_scores(self):
+        if self.created_at is None:
+            self.created_at = timezone.now()
+        self.score = wilson_score(self.upvote, self.downvote)
+        self.hot = hot_score(self.upvote, self.downvote, self.created_at)
+
+    def save(self, *args, **kwargs):
+        # keep scores in step with the vote counts on every save
+        self.update_scores()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'upvote', 'downvote'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'score', 'hot'}
+        super().save(*args, **kwargs)
+
 class UserVote(models.Model):
     VOTE_CHOICES = [
         ('upvote', 'Upvote'),
@@ -0,0 +1,41 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from .feed import dumps, orjson
+
+
+class FeedJSONRenderer(JSONRenderer):
+    # orjson is several times faster than json.dumps for big feeds
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        return b''.join(dumps(item) + b'\n' for item in items)
+
+
+def sse_event(event, data):
+    return b'event: ' + event.encode('utf-8') + b'\ndata: ' + dumps(data) + b'\n\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    # server-sent events, only used as is for errors raised before a stream starts
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        event = 'error' if response is not None and response.status_code >= 400 else 'message'
+        return sse_event(event, data)
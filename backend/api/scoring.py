@@ -0,0 +1,25 @@
+import math
+from datetime import datetime, timezone
+
+# hot score as on reddit: log of the net votes plus the age bonus, newer posts need
+# exponentially fewer votes to rank the same. Scores never need rewriting as time passes,
+# older memes fall behind because newer ones start higher
+HOT_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+HOT_DECAY_SECONDS = 45000
+
+
+def hot_score(upvote, downvote, created_at):
+    net = upvote - downvote
+    order = math.log10(max(abs(net), 1))
+    sign = 1 if net > 0 else -1 if net < 0 else 0
+    seconds = (created_at - HOT_EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_DECAY_SECONDS, 7)
+
+
+def wilson_score(upvote, downvote, z=1.96):
+    # lower bound of the 95% confidence interval of the upvote ratio
+    n = upvote + downvote
+    if n == 0:
+        return 0.0
+    phat = upvote / n
+    return (phat + z * z / (2 * n) - z * math.sqrt((phat * (1 - phat) + z * z / (4 * n)) / n)) / (1 + z * z / n)
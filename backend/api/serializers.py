@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Meme, UserVote
 
@@ -26,17 +27,34 @@ class MemeUploadSerializer(serializers.ModelSerializer):
         model = Meme
         fields = ('image', 'image_url', 'caption')
 
+class CaptionLayerSerializer(serializers.Serializer):
+    text = serializers.CharField(max_length=200)
+    zone = serializers.ListField(child=serializers.IntegerField(min_value=0), min_length=4, max_length=4)
+    font_size = serializers.IntegerField(min_value=8, max_value=400)
+
+class CaptionLayersSerializer(serializers.Serializer):
+    # every layer is drawn with an outline (25 draw.text calls) on each render, so keep the count small
+    caption_layers = CaptionLayerSerializer(many=True, allow_empty=False, max_length=10)
+
 class MemeSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     image = serializers.SerializerMethodField()
+    original = serializers.SerializerMethodField()
+    caption_layers = CaptionLayerSerializer(many=True, read_only=True)
     userVote = serializers.SerializerMethodField()
 
     class Meta:
         model = Meme
-        fields = ('id', 'user', 'image', 'image_url', 'caption', 'created_at', 'upvote', 'downvote', 'userVote')
+        fields = ('id', 'user', 'image', 'original', 'image_url', 'caption', 'caption_layers', 'created_at', 'upvote', 'downvote', 'userVote')
         read_only_fields = ('user', 'created_at')
 
     def get_image(self, obj):
+        request = self.context.get('request')
+        if obj.image and obj.caption_layers:
+            return request.build_absolute_uri(reverse('meme-render', kwargs={'id': obj.id}))
+        return self.get_original(obj)
+
+    def get_original(self, obj):
         request = self.context.get('request')
         if obj.image and hasattr(obj.image, 'url'):
             return request.build_absolute_uri(obj.image.url)
@@ -50,4 +68,11 @@ class MemeSerializer(serializers.ModelSerializer):
                 return user_vote.vote_type
             except UserVote.DoesNotExist:
                 return None
-        return None 
\ No newline at end of file
+        return None
+
+class VoteOperationSerializer(serializers.Serializer):
+    meme_id = serializers.IntegerField(min_value=1)
+    vote = serializers.ChoiceField(choices=['upvote', 'downvote', 'clear'])
+
+class BulkVoteSerializer(serializers.Serializer):
+    votes = VoteOperationSerializer(many=True, allow_empty=False, max_length=500)
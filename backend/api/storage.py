@@ -0,0 +1,184 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+WRITE_ATTEMPTS = 3
+WRITE_RETRY_DELAY = 0.5  # seconds, grows with each attempt
+
+
+class PendingFile:
+    # a spooled file waiting to be stored. Readers, the writer included, read it at their own
+    # offset instead of copying it, and the spool is closed when the last one is done
+    def __init__(self, spool, size):
+        self.spool = spool
+        self.size = size
+        self.lock = threading.Lock()
+        self.refs = 1  # the writer's
+        self.future = None
+
+    def reader(self):
+        with self.lock:
+            self.refs += 1
+        return io.BufferedReader(SpoolReader(self), buffer_size=64 * 1024)
+
+    def read_at(self, offset, size):
+        with self.lock:
+            self.spool.seek(offset)
+            return self.spool.read(size)
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs == 0:
+                self.spool.close()
+
+
+class SpoolReader(io.RawIOBase):
+    def __init__(self, pending):
+        self.pending = pending
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.pending.read_at(self.position, len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.pending.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.pending.release()
+        super().close()
+
+
+class BackgroundWriter:
+    # writes files to a storage backend off the request thread. Names are content hashes,
+    # so identical outputs are stored once and a name never points at different bytes.
+    # The spool is the only copy until the write is done, callers wait() for it before
+    # committing a row that points at the name
+    def __init__(self, storage, max_workers=4):
+        self.storage = storage
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage-writer')
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def save(self, fileobj, prefix, ext, owned=False):
+        # owned: fileobj is a spooled file the writer may keep and close, it's only read to hash it.
+        # Anything else is copied into a spool while hashing, the caller's file may be gone
+        # before the write runs
+        from ai.services import SPOOL_MAX_SIZE
+        digest = hashlib.sha256()
+        spool = fileobj if owned else tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        while chunk := fileobj.read(64 * 1024):
+            digest.update(chunk)
+            if not owned:
+                spool.write(chunk)
+        size = spool.tell()
+        spool.seek(0)
+
+        sha = digest.hexdigest()
+        name = f"{prefix}{sha[:2]}/{sha}{ext}"
+        with self.lock:
+            if name in self.pending:
+                spool.close()
+                return name
+            # submitted under the lock so _write can't drop the entry before it's added
+            entry = PendingFile(spool, size)
+            entry.future = self.executor.submit(self._write, name, entry)
+            self.pending[name] = entry
+        return name
+
+    def _write(self, name, entry):
+        try:
+            for attempt in range(1, WRITE_ATTEMPTS + 1):
+                try:
+                    self._store(name, entry)
+                    return
+                except Exception:
+                    if attempt == WRITE_ATTEMPTS:
+                        logger.exception("Giving up writing %s to storage after %d attempts", name, attempt)
+                        raise
+                    logger.warning("Writing %s to storage failed, retrying", name, exc_info=True)
+                    time.sleep(WRITE_RETRY_DELAY * attempt)
+        finally:
+            with self.lock:
+                del self.pending[name]
+            entry.release()
+
+    def _store(self, name, entry):
+        if self.storage.exists(name):
+            if self.storage.size(name) == entry.size:
+                return
+            # left over from a failed write
+            self.storage.delete(name)
+        with entry.reader() as f:
+            saved = self.storage.save(name, File(f, name=name))
+        if saved != name:
+            # another process stored the same content first, drop our copy
+            self.storage.delete(saved)
+
+    def wait(self, name, timeout=None):
+        # blocks until a queued write is done. Raises the write's error, or FileNotFoundError
+        # if nothing was queued and the file isn't stored either
+        with self.lock:
+            entry = self.pending.get(name)
+        if entry:
+            entry.future.result(timeout)
+        elif not self.storage.exists(name):
+            raise FileNotFoundError(name)
+
+    def open(self, name, mode='rb'):
+        # files that are still queued are read from the spool
+        with self.lock:
+            entry = self.pending.get(name)
+            if entry:
+                return entry.reader()
+        return self.storage.open(name, mode)
+
+
+_lock = threading.Lock()
+_writer = None
+
+
+def get_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = BackgroundWriter(default_storage, getattr(settings, 'MEDIA_WRITER_THREADS', 4))
+        return _writer
+
+
+def save_original(upload, img, prefix='memes/'):
+    # keep the upload byte for byte when it was already within the size cap
+    from ai.services import encode_image
+    uploaded = getattr(upload, 'image', None)
+    if upload is not None and uploaded is not None and uploaded.size == img.size:
+        upload.seek(0)
+        ext = os.path.splitext(upload.name)[1].lower() or '.jpg'
+        return get_writer().save(upload, prefix, ext)
+
+    # the writer keeps the encoded spool instead of copying it
+    return get_writer().save(encode_image(img), prefix, '.jpg', owned=True)
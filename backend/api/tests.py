@@ -0,0 +1,792 @@
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from unittest import mock
+from PIL import Image, ImageDraw
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+from ai import limits
+from ai.limits import AdmissionController, RateLimited, Rejected, TokenBucket
+from .models import Meme, UserVote
+from .serializers import MemeSerializer
+from .scoring import HOT_DECAY_SECONDS, hot_score, wilson_score
+from . import caching
+from .storage import BackgroundWriter, get_writer
+from .views import MemeBulkVoteView
+
+
+def jpeg_upload(size=(64, 48), name='meme.jpg'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class MemeCaptionsViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.meme = Meme.objects.create(user=self.user, caption='old')
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/memes/{self.meme.id}/captions/'
+
+    def layer(self, text='new caption'):
+        return {'text': text, 'zone': [0, 0, 100, 50], 'font_size': 20}
+
+    def test_replaces_layers(self):
+        response = self.client.put(self.url, {'caption_layers': [self.layer('a'), self.layer('b')]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.meme.refresh_from_db()
+        self.assertEqual(self.meme.caption, 'a\nb')
+        self.assertEqual(len(self.meme.caption_layers), 2)
+
+    def test_list_body_is_a_validation_error(self):
+        response = self.client.put(self.url, [self.layer()], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_layer_count_is_capped(self):
+        response = self.client.put(self.url, {'caption_layers': [self.layer()] * 11}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_owner_can_edit(self):
+        self.client.force_authenticate(User.objects.create_user('other', 'other@example.com', 'password'))
+        response = self.client.put(self.url, {'caption_layers': [self.layer()]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class RenderCacheTests(SimpleTestCase):
+    def test_widths_snap_to_the_allowed_set(self):
+        from ai.services import snap_width, RENDER_WIDTHS
+        self.assertIsNone(snap_width(None))
+        self.assertEqual(snap_width(1), RENDER_WIDTHS[0])
+        self.assertEqual(snap_width(RENDER_WIDTHS[0] + 1), RENDER_WIDTHS[1])
+        self.assertIsNone(snap_width(RENDER_WIDTHS[-1] + 1))
+
+    def test_cache_is_bounded_by_bytes(self):
+        from ai.services import ByteLRUCache
+        lru = ByteLRUCache(max_bytes=10)
+        lru.set('a', b'1234')
+        lru.set('b', b'1234')
+        lru.get('a')
+        lru.set('c', b'1234')
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), b'1234')
+        self.assertEqual(lru.size, 8)
+        lru.set('d', b'x' * 11)
+        self.assertIsNone(lru.get('d'))
+
+
+class MemeUploadViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('uploader', 'uploader@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, **extra):
+        response = self.client.post('/api/memes/upload/', {'image': jpeg_upload()}, format='multipart', **extra)
+        # let the background writer finish before the media root is removed
+        get_writer().executor.submit(lambda: None).result()
+        return response
+
+    @mock.patch('ai.services.make_caption_request', side_effect=RateLimited('docsbot rate limit wait exceeded 30s'))
+    def test_docsbot_rate_limit_is_a_429(self, make_caption_request):
+        response = self.upload()
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(Meme.objects.exists())
+
+    @mock.patch('ai.client.rate_limit', side_effect=RateLimited('deepseek rate limit wait exceeded 30s'))
+    @mock.patch('ai.services.make_caption_request', return_value='a cat')
+    def test_deepseek_rate_limit_is_a_429(self, make_caption_request, rate_limit):
+        response = self.upload()
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(Meme.objects.exists())
+
+    @mock.patch('ai.services.make_caption_request', side_effect=RateLimited('docsbot rate limit wait exceeded 30s'))
+    def test_rate_limit_is_an_error_event_when_streaming(self, make_caption_request):
+        response = self.upload(HTTP_ACCEPT='text/event-stream')
+        event, data = self.events(response)[-1]
+        self.assertEqual(event, 'error')
+        self.assertEqual(data['status'], 429)
+        self.assertFalse(Meme.objects.exists())
+
+    def events(self, response):
+        events = []
+        for chunk in b''.join(response.streaming_content).decode().strip().split('\n\n'):
+            event, data = chunk.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    @mock.patch('ai.services.ai_call', return_value='top text\nbottom text')
+    @mock.patch('ai.services.make_caption_request', return_value='a cat')
+    def test_upload_is_captioned(self, make_caption_request, ai_call):
+        response = self.upload()
+        self.assertEqual(response.status_code, 201)
+        meme = Meme.objects.get()
+        self.assertEqual(meme.caption, 'top text\nbottom text')
+        self.assertEqual(len(meme.caption_layers), 2)
+        self.assertTrue(get_writer().storage.exists(meme.image.name))
+
+    @mock.patch('ai.services.ai_call', return_value='top text\nbottom text')
+    @mock.patch('ai.services.make_caption_request', return_value='a cat')
+    def test_streamed_upload_matches_plain_upload(self, make_caption_request, ai_call):
+        events = self.events(self.upload(HTTP_ACCEPT='text/event-stream'))
+        self.assertEqual(
+            [event for event, _ in events],
+            ['queued', 'fetched', 'described', 'summarized', 'captioned', 'preview', 'rendered'],
+        )
+        meme = Meme.objects.get()
+        self.assertEqual(meme.caption, 'top text\nbottom text')
+        self.assertEqual(events[-1][1]['id'], meme.id)
+        self.assertTrue(get_writer().storage.exists(meme.image.name))
+
+    @mock.patch('ai.services.make_caption_request', return_value='a cat')
+    @mock.patch('ai.services.layout_captions', side_effect=ValueError('no room'))
+    def test_failed_captioning_keeps_the_meme(self, layout_captions, make_caption_request):
+        with mock.patch('ai.services.ai_call', return_value='caption'), self.assertLogs('api.views', 'ERROR'):
+            events = self.events(self.upload(HTTP_ACCEPT='text/event-stream'))
+        self.assertEqual([event for event, _ in events][-2:], ['failed', 'rendered'])
+        self.assertEqual(Meme.objects.get().caption_layers, [])
+
+
+@mock.patch('api.storage.WRITE_RETRY_DELAY', 0)
+class BackgroundWriterTests(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        self.storage = FileSystemStorage(location=location)
+        self.writer = BackgroundWriter(self.storage, max_workers=1)
+        self.addCleanup(self.writer.executor.shutdown)
+
+    def test_same_content_is_stored_once(self):
+        first = self.writer.save(io.BytesIO(b'meme'), 'memes/', '.jpg')
+        second = self.writer.save(io.BytesIO(b'meme'), 'memes/', '.jpg')
+        self.writer.wait(first)
+        self.assertEqual(first, second)
+        # saved again once the first write is done, the stored file is kept as is
+        with mock.patch.object(self.storage, 'delete') as delete, mock.patch.object(self.storage, 'save') as save:
+            third = self.writer.save(io.BytesIO(b'meme'), 'memes/', '.jpg')
+            self.writer.wait(third)
+        self.assertEqual(third, first)
+        delete.assert_not_called()
+        save.assert_not_called()
+        self.assertEqual(self.storage.listdir(first.rsplit('/', 1)[0])[1], [first.rsplit('/', 1)[1]])
+
+    def test_failed_write_is_retried(self):
+        save = self.storage.save
+        attempts = []
+
+        def flaky_save(name, content):
+            attempts.append(name)
+            if len(attempts) == 1:
+                raise OSError('timeout')
+            return save(name, content)
+
+        with mock.patch.object(self.storage, 'save', side_effect=flaky_save), self.assertLogs('api.storage', 'WARNING'):
+            name = self.writer.save(io.BytesIO(b'meme'), 'memes/', '.jpg')
+            self.writer.wait(name)
+        self.assertEqual(len(attempts), 2)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'meme')
+
+    def test_wait_raises_when_the_write_gives_up(self):
+        with mock.patch.object(self.storage, 'save', side_effect=OSError('disk full')), self.assertLogs('api.storage', 'ERROR'):
+            name = self.writer.save(io.BytesIO(b'meme'), 'memes/', '.jpg')
+            with self.assertRaises(OSError):
+                self.writer.wait(name)
+        with self.assertRaises(FileNotFoundError):
+            self.writer.wait(name)
+
+    def test_pending_files_are_served_before_they_are_stored(self):
+        release = threading.Event()
+        self.writer.executor.submit(release.wait)
+        name = self.writer.save(io.BytesIO(b'meme'), 'memes/', '.jpg')
+        self.assertFalse(self.storage.exists(name))
+        with self.writer.open(name) as f:
+            self.assertEqual(f.read(), b'meme')
+        release.set()
+        self.writer.wait(name)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_owned_spool_is_kept_until_the_last_reader_closes(self):
+        release = threading.Event()
+        self.writer.executor.submit(release.wait)
+        spool = tempfile.SpooledTemporaryFile()
+        spool.write(b'meme' * 1000)
+        spool.seek(0)
+        name = self.writer.save(spool, 'memes/', '.jpg', owned=True)
+        # not copied, the pending file reads from the caller's spool
+        self.assertIs(self.writer.pending[name].spool, spool)
+
+        reader = self.writer.open(name)
+        self.assertEqual(reader.read(4), b'meme')
+        release.set()
+        self.writer.wait(name)
+        # the write is done but this reader still has the spool open
+        self.assertFalse(spool.closed)
+        reader.seek(-4, io.SEEK_END)
+        self.assertEqual(reader.read(), b'meme')
+        reader.close()
+        self.assertTrue(spool.closed)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'meme' * 1000)
+
+
+class MemeRenderViewTests(APITestCase):
+    def test_missing_image_is_gone(self):
+        user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        meme = Meme.objects.create(user=user, image='memes/ab/missing.jpg', caption_layers=[])
+        response = self.client.get(f'/api/memes/{meme.id}/render/')
+        self.assertEqual(response.status_code, 410)
+
+
+class MemeBulkVoteViewTests(APITestCase):
+    url = '/api/memes/votes/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('voter', 'voter@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.memes = [Meme.objects.create(user=self.other, caption=str(i)) for i in range(3)]
+        self.client.force_authenticate(self.user)
+
+    def vote(self, *operations):
+        return self.client.post(self.url, {'votes': [{'meme_id': meme_id, 'vote': vote} for meme_id, vote in operations]}, format='json')
+
+    def counts(self, meme):
+        meme.refresh_from_db()
+        return meme.upvote, meme.downvote
+
+    def test_vote_transitions(self):
+        transitions = [
+            (None, 'upvote', (1, 0)),
+            (None, 'downvote', (0, 1)),
+            ('upvote', 'clear', (0, 0)),
+            ('downvote', 'clear', (0, 0)),
+            ('upvote', 'downvote', (0, 1)),
+            ('downvote', 'upvote', (1, 0)),
+        ]
+        for old, new, expected in transitions:
+            with self.subTest(old=old, new=new):
+                meme = Meme.objects.create(user=self.other)
+                if old:
+                    self.vote((meme.id, old))
+                response = self.vote((meme.id, new))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.counts(meme), expected)
+                vote = UserVote.objects.filter(user=self.user, meme=meme).first()
+                self.assertEqual(vote.vote_type if vote else 'clear', new)
+
+    def test_last_operation_wins(self):
+        meme = self.memes[0]
+        response = self.vote((meme.id, 'upvote'), (meme.id, 'clear'), (meme.id, 'downvote'))
+        self.assertEqual(response.data['results'], [{'id': meme.id, 'upvote': 0, 'downvote': 1, 'userVote': 'downvote'}])
+        self.assertEqual(UserVote.objects.get(user=self.user, meme=meme).vote_type, 'downvote')
+
+    def test_repeated_vote_changes_nothing(self):
+        meme = self.memes[0]
+        self.vote((meme.id, 'upvote'))
+        response = self.vote((meme.id, 'upvote'))
+        self.assertEqual(response.data['results'][0]['upvote'], 1)
+        self.assertEqual(self.counts(meme), (1, 0))
+
+    def test_clear_without_a_vote(self):
+        meme = self.memes[0]
+        response = self.vote((meme.id, 'clear'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counts(meme), (0, 0))
+        self.assertFalse(UserVote.objects.exists())
+
+    def test_missing_ids_are_reported(self):
+        response = self.vote((self.memes[0].id, 'upvote'), (999999, 'upvote'))
+        self.assertEqual(response.data['missing'], [999999])
+        self.assertEqual([result['id'] for result in response.data['results']], [self.memes[0].id])
+
+    def test_counters_never_go_below_zero(self):
+        meme = self.memes[0]
+        UserVote.objects.create(user=self.user, meme=meme, vote_type='upvote')
+        # the counter was never incremented for that vote
+        Meme.objects.filter(id=meme.id).update(upvote=0)
+        self.vote((meme.id, 'clear'))
+        self.assertEqual(self.counts(meme), (0, 0))
+
+    def test_counters_move_by_the_change(self):
+        # other users' votes are only in the counters, they aren't counted again
+        meme = self.memes[0]
+        Meme.objects.filter(id=meme.id).update(upvote=10, downvote=4)
+        self.vote((meme.id, 'downvote'))
+        self.assertEqual(self.counts(meme), (10, 5))
+        self.vote((meme.id, 'upvote'), (self.memes[1].id, 'downvote'))
+        self.assertEqual(self.counts(meme), (11, 4))
+        self.assertEqual(self.counts(self.memes[1]), (0, 1))
+
+    def test_scores_are_refreshed(self):
+        meme = self.memes[0]
+        self.vote((meme.id, 'downvote'))
+        meme.refresh_from_db()
+        self.assertEqual(meme.score, wilson_score(0, 1))
+        self.assertEqual(meme.hot, hot_score(0, 1, meme.created_at))
+
+    def test_vote_created_concurrently_is_not_an_integrity_error(self):
+        meme = self.memes[0]
+        # another batch created the vote after this one looked for existing votes
+        UserVote.objects.create(user=self.user, meme=meme, vote_type='downvote')
+        with mock.patch.object(MemeBulkVoteView, 'get_existing_votes', return_value={}):
+            response = self.vote((meme.id, 'upvote'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserVote.objects.get(user=self.user, meme=meme).vote_type, 'upvote')
+        self.assertEqual(self.counts(meme), (1, 0))
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its peak RSS (VmHWM), so imports don't count towards the upload
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def rss_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    raise OSError(f"{field} not found")
+
+
+def make_fixture(path, width, height):
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((width // 20, height // 20, width // 2 - width // 40, height - height // 20), fill=(200, 40, 40))
+    draw.ellipse((width // 2 + width // 40, height // 20, width - width // 20, height - height // 20), fill=(40, 40, 200))
+    img.save(path, format='JPEG', quality=90)
+
+
+def profile_upload(user_id, path, queue):
+    # runs in a forked process so the peak RSS belongs to this one upload only
+    with mock.patch('api.storage._writer', None), mock.patch('ai.limits._admission', None):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(id=user_id))
+        # warm up imports, decoders and the connection before measuring
+        client.post('/api/memes/upload/', {'image': jpeg_upload()}, format='multipart')
+        reset_peak_rss()
+        baseline = rss_mb('VmRSS')
+
+        with open(path, 'rb') as f:
+            response = client.post('/api/memes/upload/', {'image': f}, format='multipart')
+        assert response.status_code == 201, response.data
+        response = client.get(f"/api/memes/{Meme.objects.latest('id').id}/render/")
+        assert response.status_code == 200, response.status_code
+        queue.put(rss_mb('VmHWM') - baseline)
+
+
+@unittest.skipUnless(reset_peak_rss() and 'fork' in multiprocessing.get_all_start_methods(), "needs Linux")
+class UploadMemoryTests(TransactionTestCase):
+    # standard fixtures: (name, width, height)
+    fixture_sizes = [
+        ('1mp', 1280, 800),
+        ('12mp', 4000, 3000),
+        ('24mp', 6000, 4000),
+    ]
+    # peak RSS an upload may add on top of an idle worker, in MB
+    budget_mb = 80
+
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('uploader', 'uploader@example.com', 'password')
+
+    @mock.patch('ai.services.ai_call', return_value='When the fixture is twelve megapixels\nAnd the worker has 256 MB')
+    @mock.patch('ai.services.make_caption_request', return_value='two shapes')
+    def test_upload_peak_rss_is_within_budget(self, make_caption_request, ai_call):
+        ctx = multiprocessing.get_context('fork')
+        for name, width, height in self.fixture_sizes:
+            with self.subTest(fixture=name):
+                path = os.path.join(self.tmp, f'{name}.jpg')
+                make_fixture(path, width, height)
+
+                # the child opens its own database connection
+                connections.close_all()
+                queue = ctx.Queue()
+                process = ctx.Process(target=profile_upload, args=(self.user.id, path, queue))
+                process.start()
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+                self.assertLess(queue.get(), self.budget_mb)
+
+
+class FeedCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('voter', 'voter@example.com', 'password')
+        self.memes = [Meme.objects.create(user=self.user, caption=str(i)) for i in range(3)]
+        UserVote.objects.create(user=self.user, meme=self.memes[0], vote_type='upvote')
+
+    def test_only_missing_memes_are_queried(self):
+        ids = [meme.id for meme in self.memes]
+        with self.assertNumQueries(1):
+            votes = caching.get_user_votes(self.user.id, ids[:2])
+        self.assertEqual(votes, {ids[0]: 'upvote', ids[1]: None})
+        with self.assertNumQueries(1):
+            votes = caching.get_user_votes(self.user.id, ids)
+        self.assertEqual(votes, {ids[0]: 'upvote', ids[1]: None, ids[2]: None})
+        with self.assertNumQueries(0):
+            caching.get_user_votes(self.user.id, ids)
+
+    def warm(self):
+        self.client.get('/api/memes/')
+        self.client.get(f'/api/memes/user/{self.user.username}/')
+
+    def cached(self, *keys):
+        return set(cache.get_many(keys))
+
+    def test_vote_clears_its_fragment_after_commit(self):
+        self.warm()
+        meme = self.memes[1]
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(f'/api/memes/{meme.id}/upvote/')
+            self.assertIn(caching.fragment_key(meme.id), self.cached(caching.fragment_key(meme.id)))
+        for callback in callbacks:
+            callback()
+        keys = [caching.fragment_key(m.id) for m in self.memes] + [caching.feed_ids_key()]
+        self.assertEqual(self.cached(*keys), set(keys) - {caching.fragment_key(meme.id)})
+        self.assertEqual(self.client.get('/api/memes/').data[1]['upvote'], 1)
+
+    def test_caption_edit_clears_its_fragment(self):
+        self.warm()
+        meme = self.memes[0]
+        self.client.force_authenticate(self.user)
+        layers = [{'text': 'edited', 'zone': [0, 0, 10, 10], 'font_size': 12}]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/memes/{meme.id}/captions/', {'caption_layers': layers}, format='json')
+        keys = [caching.fragment_key(m.id) for m in self.memes] + [caching.feed_ids_key(), caching.feed_ids_key(self.user.username)]
+        self.assertEqual(self.cached(*keys), set(keys) - {caching.fragment_key(meme.id)})
+        self.assertEqual(self.client.get(f'/api/memes/{meme.id}/').data['caption'], 'edited')
+
+    @mock.patch('ai.services.ai_call', return_value='top text')
+    @mock.patch('ai.services.make_caption_request', return_value='a cat')
+    def test_upload_clears_the_id_lists_after_commit(self, make_caption_request, ai_call):
+        self.warm()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.client.force_authenticate(self.user)
+        id_keys = [caching.feed_ids_key(), caching.feed_ids_key(self.user.username)]
+        with override_settings(MEDIA_ROOT=media_root), self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/memes/upload/', {'image': jpeg_upload()}, format='multipart')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(self.cached(*id_keys), set(id_keys))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.cached(*id_keys), set())
+        fragment_keys = [caching.fragment_key(m.id) for m in self.memes]
+        self.assertEqual(self.cached(*fragment_keys), set(fragment_keys))
+        self.assertEqual(len(self.client.get('/api/memes/').data), 4)
+
+    def test_anonymous_and_voter_share_fragments(self):
+        anonymous = self.client.get('/api/memes/').data
+        self.client.force_authenticate(self.user)
+        # ids and fragments come from the cache, only the votes are queried
+        with self.assertNumQueries(1):
+            authenticated = self.client.get('/api/memes/').data
+        self.assertEqual([item['userVote'] for item in anonymous], [None] * 3)
+        votes = {item['id']: item.pop('userVote') for item in authenticated}
+        self.assertEqual(votes, {self.memes[0].id: 'upvote', self.memes[1].id: None, self.memes[2].id: None})
+        self.assertEqual([{**item, 'userVote': None} for item in authenticated], anonymous)
+
+    def test_vote_only_clears_that_meme(self):
+        ids = [meme.id for meme in self.memes]
+        caching.get_user_votes(self.user.id, ids)
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/memes/{ids[1]}/downvote/')
+        with self.assertNumQueries(1):
+            votes = caching.get_user_votes(self.user.id, ids)
+        self.assertEqual(votes, {ids[0]: 'upvote', ids[1]: 'downvote', ids[2]: None})
+
+
+class MemeVoteViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('voter', 'voter@example.com', 'password')
+        self.meme = Meme.objects.create(user=self.user, caption='caption')
+        self.client.force_authenticate(self.user)
+
+    def test_vote_only_writes_the_counters(self):
+        # a caption edit made while the vote ran isn't overwritten
+        with mock.patch.object(Meme, 'save', autospec=True, side_effect=Meme.save) as save:
+            response = self.client.post(f'/api/memes/{self.meme.id}/upvote/')
+        self.assertEqual(response.data, {'upvote': 1, 'downvote': 0})
+        self.assertEqual(set(save.call_args.kwargs['update_fields']), {'upvote', 'downvote'})
+        self.meme.refresh_from_db()
+        self.assertEqual(self.meme.score, wilson_score(1, 0))
+
+    def test_toggle_and_switch(self):
+        url = f'/api/memes/{self.meme.id}/'
+        self.assertEqual(self.client.post(url + 'downvote/').data, {'upvote': 0, 'downvote': 1})
+        self.assertEqual(self.client.post(url + 'upvote/').data, {'upvote': 1, 'downvote': 0})
+        self.assertEqual(self.client.post(url + 'upvote/').data, {'upvote': 0, 'downvote': 0})
+        self.assertFalse(UserVote.objects.exists())
+
+
+class ScoringTests(SimpleTestCase):
+    def test_hot_score(self):
+        now = timezone.now()
+        self.assertGreater(hot_score(10, 0, now), hot_score(0, 0, now))
+        self.assertLess(hot_score(0, 10, now), hot_score(0, 0, now))
+        # ten times the net votes is worth one decay period of age
+        older = now - timedelta(seconds=HOT_DECAY_SECONDS)
+        self.assertAlmostEqual(hot_score(100, 0, older), hot_score(10, 0, now), places=5)
+        self.assertGreater(hot_score(5, 0, now), hot_score(5, 0, older))
+
+    def test_wilson_score(self):
+        self.assertEqual(wilson_score(0, 0), 0.0)
+        # the same ratio with more votes is more certain
+        self.assertGreater(wilson_score(90, 10), wilson_score(9, 1))
+        self.assertGreater(wilson_score(9, 1), wilson_score(1, 0))
+        self.assertLess(wilson_score(50, 50), 0.5)
+
+
+class RankedFeedTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('poster', 'poster@example.com', 'password')
+
+    def make_meme(self, upvote, downvote, age):
+        meme = Meme.objects.create(user=self.user)
+        created_at = timezone.now() - age
+        Meme.objects.filter(id=meme.id).update(
+            created_at=created_at, upvote=upvote, downvote=downvote,
+            score=wilson_score(upvote, downvote), hot=hot_score(upvote, downvote, created_at),
+        )
+        return meme.id
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_hot_ordering(self):
+        old_popular = self.make_meme(1000, 0, timedelta(days=2))
+        new_quiet = self.make_meme(0, 0, timedelta(hours=1))
+        new_popular = self.make_meme(100, 0, timedelta(minutes=5))
+        self.assertEqual(self.ids('/api/memes/hot/'), [new_popular, new_quiet, old_popular])
+
+    def test_top_periods(self):
+        memes = {
+            'hour': self.make_meme(1, 1, timedelta(hours=1)),
+            'days': self.make_meme(5, 1, timedelta(days=3)),
+            'weeks': self.make_meme(20, 1, timedelta(days=20)),
+            'months': self.make_meme(50, 1, timedelta(days=100)),
+            'years': self.make_meme(100, 1, timedelta(days=400)),
+        }
+        expected = {
+            'day': ['hour'],
+            'week': ['days', 'hour'],
+            'month': ['weeks', 'days', 'hour'],
+            'year': ['months', 'weeks', 'days', 'hour'],
+            'all': ['years', 'months', 'weeks', 'days', 'hour'],
+        }
+        for period, names in expected.items():
+            with self.subTest(period=period):
+                self.assertEqual(self.ids(f'/api/memes/top/?period={period}'), [memes[name] for name in names])
+        self.assertEqual(self.ids('/api/memes/top/'), [memes['days'], memes['hour']])
+
+    def test_limit_and_offset(self):
+        ids = [self.make_meme(votes, 0, timedelta(hours=1)) for votes in (1, 2, 3)]
+        self.assertEqual(self.ids('/api/memes/hot/?limit=2'), [ids[2], ids[1]])
+        self.assertEqual(self.ids('/api/memes/hot/?limit=2&offset=2'), [ids[0]])
+
+    def test_bad_parameters(self):
+        for url in ('/api/memes/top/?period=decade', '/api/memes/hot/?limit=ten', '/api/memes/hot/?offset=x'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class RecomputeScoresTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('poster', 'poster@example.com', 'password')
+        self.ids = [Meme.objects.create(user=user, upvote=i, downvote=1).id for i in range(6)]
+        # leave id gaps wider than a batch
+        Meme.objects.filter(id__in=self.ids[2:4]).delete()
+        Meme.objects.filter(id=self.ids[0]).update(created_at=timezone.now() - timedelta(days=30))
+        Meme.objects.update(score=0, hot=0)
+
+    def recompute(self, *args):
+        out = io.StringIO()
+        call_command('recompute_scores', *args, stdout=out)
+        return out.getvalue()
+
+    def assertScoresCurrent(self, memes):
+        for meme in memes:
+            self.assertEqual(meme.score, wilson_score(meme.upvote, meme.downvote))
+            self.assertEqual(meme.hot, hot_score(meme.upvote, meme.downvote, meme.created_at))
+
+    def test_backfill_in_batches(self):
+        self.assertIn('Updated 4 memes', self.recompute('--batch-size', '1'))
+        self.assertScoresCurrent(Meme.objects.all())
+        self.assertIn('Updated 0 memes', self.recompute('--batch-size', '2'))
+
+    def test_since_days(self):
+        self.assertIn('Updated 3 memes', self.recompute('--since-days', '7'))
+        self.assertScoresCurrent(Meme.objects.exclude(id=self.ids[0]))
+        self.assertEqual(Meme.objects.get(id=self.ids[0]).hot, 0)
+
+    def test_no_memes(self):
+        Meme.objects.all().delete()
+        self.assertIn('No memes to update', self.recompute())
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def controller(self, max_concurrent=1, max_queue=1, per_user=1, queue_timeout=1):
+        return AdmissionController(max_concurrent, max_queue, per_user, queue_timeout)
+
+    def test_per_user_limit(self):
+        admission = self.controller(max_concurrent=2)
+        with admission.admit('a'):
+            with self.assertRaises(Rejected) as rejected, admission.admit('a'):
+                pass
+            self.assertEqual(str(rejected.exception), 'user_limit')
+            with admission.admit('b'):
+                pass
+        self.assertEqual(admission.metrics()['rejected'], {'user_limit': 1})
+
+    def test_queue_full(self):
+        admission = self.controller(max_queue=0, queue_timeout=5)
+        with admission.admit('a'):
+            with self.assertRaises(Rejected) as rejected, admission.admit('b'):
+                pass
+        self.assertEqual(str(rejected.exception), 'queue_full')
+        self.assertEqual(rejected.exception.retry_after, 5)
+
+    def test_queue_timeout_releases_the_user(self):
+        admission = self.controller(queue_timeout=0.05)
+        with admission.admit('a'):
+            with self.assertRaises(Rejected) as rejected, admission.admit('b'):
+                pass
+        self.assertEqual(str(rejected.exception), 'queue_timeout')
+        with admission.admit('b'):
+            pass
+        self.assertEqual(admission.metrics()['queue_depth'], 0)
+
+    def test_slot_is_released_when_the_pipeline_raises(self):
+        admission = self.controller()
+        with self.assertRaises(ValueError), admission.admit('a'):
+            raise ValueError('pipeline failed')
+        self.assertEqual(admission.metrics()['running'], 0)
+        with admission.admit('a'):
+            pass
+
+    def test_queued_request_runs_when_a_slot_frees(self):
+        admission = self.controller()
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            with admission.admit('a'):
+                started.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        started.wait()
+        threading.Timer(0.05, release.set).start()
+        with admission.admit('b'):
+            pass
+        holder.join()
+
+        metrics = admission.metrics()
+        self.assertEqual(metrics['admitted'], 2)
+        self.assertEqual(metrics['running'], 0)
+        self.assertGreaterEqual(metrics['wait_time_max'], 0.04)
+        self.assertEqual(metrics['wait_time_p95'], metrics['wait_time_max'])
+        self.assertAlmostEqual(metrics['wait_time_avg'], sum(admission.wait_times) / 2)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=50, capacity=2)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0))
+        # one token takes 20ms at 50/s
+        self.assertTrue(bucket.acquire(timeout=0.1))
+
+    def test_rate_limit_raises_when_the_wait_is_too_long(self):
+        with mock.patch.dict(limits._buckets, {'docsbot': TokenBucket(rate=0.1, capacity=1)}):
+            limits.rate_limit('docsbot', timeout=0)
+            with self.assertRaises(RateLimited):
+                limits.rate_limit('docsbot', timeout=0.01)
+
+    @override_settings(AI_RATE_LIMITS={'docsbot': (8, 8)}, AI_WORKER_PROCESSES=4)
+    def test_limits_are_split_between_workers(self):
+        with mock.patch.dict(limits._buckets, clear=True):
+            bucket = limits.get_bucket('docsbot')
+        self.assertEqual((bucket.rate, bucket.capacity), (2, 2))
+
+
+class AIMetricsViewTests(APITestCase):
+    def test_admin_only(self):
+        self.assertEqual(self.client.get('/api/ai/metrics/').status_code, 401)
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+        self.assertEqual(self.client.get('/api/ai/metrics/').status_code, 403)
+        self.client.force_authenticate(User.objects.create_user('admin', 'admin@example.com', 'password', is_staff=True))
+        response = self.client.get('/api/ai/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('wait_time_p95', response.data['admission'])
+        self.assertIn('rate_limits', response.data)
+
+
+class FeedOutputTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.poster = User.objects.create_user('poster', 'poster@example.com', 'password')
+        self.voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+        layers = [{'text': 'top text', 'zone': [0, 0, 100, 50], 'font_size': 20}]
+        captioned = Meme.objects.create(user=self.poster, image='memes/ab/captioned.jpg', caption='top text', caption_layers=layers, crop_box=[0, 0, 100, 100])
+        Meme.objects.create(user=self.poster, image='memes/cd/plain.jpg')
+        Meme.objects.create(user=self.poster, image_url='https://example.com/meme.png', caption='linked')
+        UserVote.objects.create(user=self.voter, meme=captioned, vote_type='downvote')
+
+    def expected(self, user=None):
+        request = Request(APIRequestFactory().get('/api/memes/'))
+        request.user = user or AnonymousUser()
+        data = MemeSerializer(Meme.objects.order_by('-created_at'), many=True, context={'request': request}).data
+        return json.loads(json.dumps(data))
+
+    def assertFeedMatchesSerializer(self, user=None):
+        expected = self.expected(user)
+        self.assertEqual(json.loads(self.client.get('/api/memes/').content), expected)
+        response = self.client.get('/api/memes/?format=ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_anonymous(self):
+        self.assertFeedMatchesSerializer()
+
+    def test_voter(self):
+        self.client.force_authenticate(self.voter)
+        self.assertFeedMatchesSerializer(self.voter)
+        self.assertIn('downvote', [item['userVote'] for item in self.expected(self.voter)])
@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import RegisterView, LoginView, ProfileView, MemeDetailView, MemeListByUserView, MemeListView, MemeUploadView, MemeUpvoteView, MemeDownvoteView
+from .views import RegisterView, LoginView, ProfileView, MemeDetailView, MemeListByUserView, MemeListView, MemeUploadView, MemeUpvoteView, MemeDownvoteView, MemeRenderView, MemeCaptionsView, AIMetricsView, MemeHotListView, MemeTopListView, MemeBulkVoteView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
@@ -10,7 +10,13 @@ urlpatterns = [
     path('memes/<int:id>/', MemeDetailView.as_view(), name='meme-detail'),
     path('memes/user/<str:username>/', MemeListByUserView.as_view(), name='memes-by-user'),
     path('memes/', MemeListView.as_view(), name='memes-list'),
+    path('memes/hot/', MemeHotListView.as_view(), name='memes-hot'),
+    path('memes/top/', MemeTopListView.as_view(), name='memes-top'),
     path('memes/upload/', MemeUploadView.as_view(), name='meme-upload'),
+    path('memes/<int:id>/render/', MemeRenderView.as_view(), name='meme-render'),
+    path('memes/<int:id>/captions/', MemeCaptionsView.as_view(), name='meme-captions'),
+    path('ai/metrics/', AIMetricsView.as_view(), name='ai-metrics'),
+    path('memes/votes/', MemeBulkVoteView.as_view(), name='meme-bulk-vote'),
     path('memes/<int:id>/upvote/', MemeUpvoteView.as_view(), name='meme-upvote'),
     path('memes/<int:id>/downvote/', MemeDownvoteView.as_view(), name='meme-downvote'),
 ] 
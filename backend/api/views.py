@@ -5,17 +5,27 @@ from django.contrib.auth.models import User
 from .serializers import RegisterSerializer, UserSerializer, MemeUploadSerializer
 from rest_framework.response import Response
 from .models import Meme, UserVote
-from .serializers import MemeSerializer
+from .serializers import MemeSerializer, CaptionLayersSerializer, BulkVoteSerializer
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
 from rest_framework.views import APIView
 from django.db import transaction
-from ai.services import get_image_context, generate_meme_captions, meme_with_captions
-from django.core.files.base import ContentFile
-import io
-from ai.services import get_image_context, generate_meme_captions, meme_with_captions
-from django.core.files.base import ContentFile
-import io
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from .feed import serialize_feed, iter_ndjson
+from .renderers import FeedJSONRenderer, NDJSONRenderer, EventStreamRenderer, sse_event
+from .storage import get_writer, save_original
+from . import caching
+from rest_framework.exceptions import Throttled, ValidationError
+from django.utils import timezone
+from datetime import timedelta
+from ai import limits
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -42,8 +52,34 @@ class MemeDetailView(generics.RetrieveAPIView):
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def retrieve(self, request, *args, **kwargs):
+        # served from the cached fragment, the same one the feeds use
+        items = serialize_feed(request, ids=[self.kwargs['id']])
+        if not items:
+            raise Http404
+        return Response(items[0])
+
+# Fast list path: values() rows instead of model instances, orjson output,
+# and NDJSON streaming with ?format=ndjson or Accept: application/x-ndjson.
+# Items come from cached per-meme fragments with the user's votes overlaid,
+# and the id list itself is cached under get_ids_cache_key()
+class MemeFeedMixin:
+    renderer_classes = (FeedJSONRenderer, NDJSONRenderer, BrowsableAPIRenderer)
+    ids_timeout = caching.FEED_IDS_TIMEOUT
+
+    def get_ids_cache_key(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        key = self.get_ids_cache_key()
+        ids = caching.get_ids(key, lambda: list(queryset.values_list('id', flat=True)), self.ids_timeout) if key else None
+        if request.accepted_renderer.format == 'ndjson':
+            return StreamingHttpResponse(iter_ndjson(request, queryset, ids), content_type=NDJSONRenderer.media_type)
+        return Response(serialize_feed(request, queryset, ids))
+
 # Get memes by username
-class MemeListByUserView(generics.ListAPIView):
+class MemeListByUserView(MemeFeedMixin, generics.ListAPIView):
     serializer_class = MemeSerializer
     permission_classes = (permissions.AllowAny,)
 
@@ -54,8 +90,11 @@ class MemeListByUserView(generics.ListAPIView):
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def get_ids_cache_key(self):
+        return caching.feed_ids_key(self.kwargs['username'])
+
 # Get all memes
-class MemeListView(generics.ListAPIView):
+class MemeListView(MemeFeedMixin, generics.ListAPIView):
     queryset = Meme.objects.all().order_by('-created_at')
     serializer_class = MemeSerializer
     permission_classes = (permissions.AllowAny,)
@@ -63,47 +102,241 @@ class MemeListView(generics.ListAPIView):
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def get_ids_cache_key(self):
+        return caching.feed_ids_key()
+
+# Ranked feeds served from the score indexes, paged with ?limit=&offset=
+class MemeRankedListView(MemeFeedMixin, generics.ListAPIView):
+    serializer_class = MemeSerializer
+    permission_classes = (permissions.AllowAny,)
+    ordering = ()
+    default_limit = 50
+    max_limit = 200
+    # rankings move with every vote, so the id lists are only cached briefly
+    ids_timeout = caching.RANKED_IDS_TIMEOUT
+
+    def get_page(self):
+        try:
+            limit = min(int(self.request.query_params.get('limit', self.default_limit)), self.max_limit)
+            offset = max(int(self.request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            raise ValidationError({'detail': 'limit and offset must be integers.'})
+        return offset, max(limit, 0)
+
+    def get_ranking(self):
+        return ''
+
+    def get_ranked_queryset(self):
+        return Meme.objects.all()
+
+    def get_queryset(self):
+        offset, limit = self.get_page()
+        return self.get_ranked_queryset().order_by(*self.ordering)[offset:offset + limit]
+
+    def get_ids_cache_key(self):
+        offset, limit = self.get_page()
+        return f"meme:ranked-ids:{self.__class__.__name__}:{self.get_ranking()}:{offset}:{limit}"
+
+# Get hot memes
+class MemeHotListView(MemeRankedListView):
+    ordering = ('-hot', '-id')
+
+# Get top memes, ?period=day|week|month|year|all
+class MemeTopListView(MemeRankedListView):
+    ordering = ('-score', '-id')
+    periods = {
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1),
+        'month': timedelta(days=30),
+        'year': timedelta(days=365),
+        'all': None,
+    }
+
+    def get_ranking(self):
+        period = self.request.query_params.get('period', 'week')
+        if period not in self.periods:
+            raise ValidationError({'period': f'Use one of: {", ".join(self.periods)}.'})
+        return period
+
+    def get_ranked_queryset(self):
+        queryset = Meme.objects.all()
+        period = self.periods[self.get_ranking()]
+        if period:
+            queryset = queryset.filter(created_at__gte=timezone.now() - period)
+        return queryset
+
 # Upload meme
 class MemeUploadView(generics.CreateAPIView):
     serializer_class = MemeUploadSerializer
     permission_classes = (permissions.IsAuthenticated,)
     parser_classes = (MultiPartParser, FormParser)
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer, EventStreamRenderer)
+
+    def create(self, request, *args, **kwargs):
+        # with Accept: text/event-stream (or ?format=sse) progress is streamed as the pipeline runs
+        if request.accepted_renderer.format == 'sse':
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            response = StreamingHttpResponse(self.stream_create(serializer), content_type=EventStreamRenderer.media_type)
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        # bound how many pipelines run at once, reject with 429 instead of piling up
+        try:
+            with limits.get_admission().admit(request.user.id):
+                return super().create(request, *args, **kwargs)
+        except limits.Rejected as e:
+            raise Throttled(wait=e.retry_after, detail=f"Meme generation is busy ({e}), try again later.")
+        except limits.RateLimited:
+            # the meme row was rolled back with perform_create's transaction
+            raise Throttled(detail="AI services are rate limited, try again later.")
 
     @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-        # save meme first to get the image path
-        meme = serializer.save(user=self.request.user)
-        image_source = meme.image.path if meme.image else meme.image_url
-             
+        for stage, result in self.run_pipeline(serializer):
+            pass
+
+    def run_pipeline(self, serializer):
+        # the upload steps shared by perform_create and stream_create, yielding (stage, result)
+        # as each one finishes: created, fetched, described, summarized, captioned (or failed).
+        # callers run it inside a transaction
+        # ai.services pulls in cv2, numpy, PIL and openai, only load it where it's needed
+        from ai.services import iter_meme_stages, load_image, MAX_INPUT_SIZE
+        # the upload is not written as is, only the capped original is stored, off the request thread
+        upload = serializer.validated_data.get('image')
+        meme = serializer.save(user=self.request.user, image=None)
+        yield 'created', meme
+        image_source = upload or meme.image_url
+
         if image_source:
             try:
-                context = get_image_context(image_source)
-                captions = generate_meme_captions(context)
-                final_meme = meme_with_captions(image_source, captions)
-                
-                meme.caption = "\n".join(captions)
-
-                buffer = io.BytesIO()
-                final_meme.save(buffer, format='JPEG', quality=90)
-                buffer.seek(0)
-                
-                filename = f"ai_meme_{meme.id}.jpg"
-                meme.image.save(
-                    filename,
-                    ContentFile(buffer.read()),
-                    save=False
-                )
-                meme.save()
-            except Exception as e:
-                pass
+                img = load_image(image_source, max_size=MAX_INPUT_SIZE)
+                meme.image.name = save_original(upload, img)
+                meme.save(update_fields=['image'])
+                yield 'fetched', img
+
+                for stage, result in iter_meme_stages(img):
+                    if stage == 'captioned':
+                        captions, crop_box, layers = result
+                        meme.caption = "\n".join(captions)
+                        meme.crop_box = list(crop_box)
+                        meme.caption_layers = layers
+                        meme.save()
+                    yield stage, result
+            except limits.RateLimited:
+                raise
+            except Exception:
+                # the meme is kept without captions
+                logger.exception("Error generating captions for meme %s", meme.id)
+                yield 'failed', None
+            if meme.image:
+                # the write overlapped the AI calls, make sure it's stored before the row commits
+                get_writer().wait(meme.image.name)
+        caching.invalidate_feeds(self.request.user.username)
+
+    def stream_create(self, serializer):
+        # runs the pipeline inside the response, so it uses the same worker thread a plain
+        # upload would and sends an event after each stage:
+        # queued, fetched, described, summarized, captioned, preview (or failed), rendered (or error)
+        from ai.services import render_meme, render_preview
+        yield sse_event('queued', {})
+        try:
+            with limits.get_admission().admit(self.request.user.id):
+                with transaction.atomic():
+                    for stage, result in self.run_pipeline(serializer):
+                        if stage == 'created':
+                            meme = result
+                        elif stage == 'fetched':
+                            img = result
+                            yield sse_event(stage, {'id': meme.id, 'width': img.width, 'height': img.height})
+                        elif stage == 'described':
+                            yield sse_event(stage, {})
+                        elif stage == 'summarized':
+                            yield sse_event(stage, {'summary': result})
+                        elif stage == 'captioned':
+                            captions, crop_box, layers = result
+                            yield sse_event(stage, {'captions': captions, 'caption_layers': layers})
+                            preview = base64.b64encode(render_preview(img, crop_box, layers)).decode('ascii')
+                            yield sse_event('preview', {'image': f"data:image/jpeg;base64,{preview}"})
+                        elif stage == 'failed':
+                            yield sse_event(stage, {'detail': 'Caption generation failed, the meme was saved without captions.'})
+                    img = None
+
+                if meme.image:
+                    # warm the render cache so the client's first GET of the image is a hit
+                    render_meme(meme.image.name, meme.crop_box, meme.caption_layers, opener=get_writer().open)
+                yield sse_event('rendered', serialize_feed(self.request, ids=[meme.id])[0])
+        except limits.Rejected as e:
+            yield sse_event('error', {'status': 429, 'detail': f"Meme generation is busy ({e}), try again later."})
+        except limits.RateLimited:
+            yield sse_event('error', {'status': 429, 'detail': "AI services are rate limited, try again later."})
+        except Exception:
+            logger.exception("Error generating meme")
+            yield sse_event('error', {'status': 500, 'detail': 'Meme generation failed.'})
+
+# Render meme with its captions, e.g. ?width=400&fmt=webp
+class MemeRenderView(APIView):
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, id):
+        from ai.services import render_meme, RENDER_FORMATS
+        meme = get_object_or_404(Meme, id=id)
+        if not meme.image:
+            return Response({'detail': 'Meme has no image.'}, status=status.HTTP_404_NOT_FOUND)
+
+        fmt = request.query_params.get('fmt', 'jpeg').lower()
+        if fmt not in RENDER_FORMATS:
+            return Response({'detail': f'Unsupported format, use one of: {", ".join(RENDER_FORMATS)}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        width = request.query_params.get('width')
+        try:
+            width = int(width) if width else None
+        except ValueError:
+            return Response({'detail': 'Width must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if width is not None and width <= 0:
+            return Response({'detail': 'Width must be a positive integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            data = render_meme(meme.image.name, meme.crop_box, meme.caption_layers, width=width, fmt=fmt, opener=get_writer().open)
+        except FileNotFoundError:
+            # uploads only commit once their image is stored, so it's gone for good
+            return Response({'detail': 'Meme image is no longer available.'}, status=status.HTTP_410_GONE)
+        return HttpResponse(data, content_type=RENDER_FORMATS[fmt][1])
+
+# Admission queue and upstream rate limit metrics
+class AIMetricsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(limits.metrics(), status=status.HTTP_200_OK)
+
+# Replace caption layers (text, zones, font size) without rerunning the AI pipeline
+class MemeCaptionsView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def put(self, request, id):
+        meme = get_object_or_404(Meme, id=id)
+        if meme.user_id != request.user.id:
+            return Response({'detail': 'You can only edit your own memes.'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = CaptionLayersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        layers = serializer.validated_data['caption_layers']
+
+        meme.caption_layers = layers
+        meme.caption = "\n".join(layer['text'] for layer in layers)
+        meme.save(update_fields=['caption_layers', 'caption'])
+        caching.invalidate_memes([meme.id])
+        return Response(MemeSerializer(meme, context={'request': request}).data, status=status.HTTP_200_OK)
 
 class MemeUpvoteView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     @transaction.atomic
     def post(self, request, id):
-        meme = get_object_or_404(Meme, id=id)
+        # locked like in MemeBulkVoteView, so concurrent votes on this meme don't overwrite each other
+        meme = get_object_or_404(Meme.objects.select_for_update(), id=id)
         user = request.user
         
         # Get or create user vote
@@ -128,7 +361,9 @@ class MemeUpvoteView(APIView):
             # New upvote
             meme.upvote += 1
             
-        meme.save()
+        meme.save(update_fields=['upvote', 'downvote'])
+        caching.invalidate_memes([meme.id])
+        caching.invalidate_user_votes(user.id, [meme.id])
         return Response({'upvote': meme.upvote, 'downvote': meme.downvote}, status=status.HTTP_200_OK)
 
 class MemeDownvoteView(APIView):
@@ -136,7 +371,8 @@ class MemeDownvoteView(APIView):
 
     @transaction.atomic
     def post(self, request, id):
-        meme = get_object_or_404(Meme, id=id)
+        # locked like in MemeBulkVoteView, so concurrent votes on this meme don't overwrite each other
+        meme = get_object_or_404(Meme.objects.select_for_update(), id=id)
         user = request.user
         
         # Get or create user vote
@@ -161,5 +397,80 @@ class MemeDownvoteView(APIView):
             # New downvote
             meme.downvote += 1
             
-        meme.save()
-        return Response({'upvote': meme.upvote, 'downvote': meme.downvote}, status=status.HTTP_200_OK)
\ No newline at end of file
+        meme.save(update_fields=['upvote', 'downvote'])
+        caching.invalidate_memes([meme.id])
+        caching.invalidate_user_votes(user.id, [meme.id])
+        return Response({'upvote': meme.upvote, 'downvote': meme.downvote}, status=status.HTTP_200_OK)
+
+# Apply a batch of votes, e.g. synced from an offline client:
+# {"votes": [{"meme_id": 1, "vote": "upvote" | "downvote" | "clear"}, ...]}
+# Each operation sets the final vote (it doesn't toggle), the last one per meme wins
+class MemeBulkVoteView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    # how the upvote/downvote counters move for each (old vote, new vote)
+    deltas = {
+        (None, 'upvote'): (1, 0),
+        (None, 'downvote'): (0, 1),
+        ('upvote', None): (-1, 0),
+        ('downvote', None): (0, -1),
+        ('upvote', 'downvote'): (-1, 1),
+        ('downvote', 'upvote'): (1, -1),
+    }
+
+    def get_existing_votes(self, user, meme_ids):
+        return dict(UserVote.objects.filter(user=user, meme_id__in=meme_ids).values_list('meme_id', 'vote_type'))
+
+    @transaction.atomic
+    def post(self, request):
+        serializer = BulkVoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+
+        wanted = {}
+        for operation in serializer.validated_data['votes']:
+            wanted[operation['meme_id']] = None if operation['vote'] == 'clear' else operation['vote']
+
+        # lock the memes first, concurrent batches touching the same memes then run one after the other
+        meme_ids = set(Meme.objects.select_for_update().filter(id__in=wanted).order_by('id').values_list('id', flat=True))
+        missing = sorted(set(wanted) - meme_ids)
+        existing = self.get_existing_votes(user, meme_ids)
+        changed_ids = {meme_id for meme_id in meme_ids if existing.get(meme_id) != wanted[meme_id]}
+
+        cleared = [meme_id for meme_id in changed_ids if wanted[meme_id] is None]
+        UserVote.objects.filter(user=user, meme_id__in=cleared).delete()
+        # a vote that already exists never fails the batch, its type is corrected below
+        UserVote.objects.bulk_create(
+            [UserVote(user=user, meme_id=meme_id, vote_type=wanted[meme_id]) for meme_id in changed_ids if wanted[meme_id]],
+            ignore_conflicts=True,
+        )
+        for vote_type in ('upvote', 'downvote'):
+            ids = [meme_id for meme_id in changed_ids if wanted[meme_id] == vote_type]
+            UserVote.objects.filter(user=user, meme_id__in=ids).exclude(vote_type=vote_type).update(vote_type=vote_type)
+
+        # the memes are locked, so existing -> wanted is exactly how each counter moves.
+        # one UPDATE for the whole batch, memes with the same change share a When
+        by_delta = {}
+        for meme_id in changed_ids:
+            by_delta.setdefault(self.deltas[(existing.get(meme_id), wanted[meme_id])], []).append(meme_id)
+        if by_delta:
+            Meme.objects.filter(id__in=changed_ids).update(**{
+                field: Greatest(F(field) + Case(
+                    *[When(id__in=ids, then=Value(delta[index])) for delta, ids in by_delta.items()],
+                    default=Value(0),
+                ), 0)
+                for index, field in enumerate(('upvote', 'downvote'))
+            })
+
+        memes = list(Meme.objects.filter(id__in=meme_ids).only('id', 'upvote', 'downvote', 'created_at'))
+        changed = [meme for meme in memes if meme.id in changed_ids]
+        for meme in changed:
+            meme.update_scores()
+        Meme.objects.bulk_update(changed, ['score', 'hot'])
+
+        caching.invalidate_memes([meme.id for meme in changed])
+        caching.invalidate_user_votes(user.id, changed_ids)
+        results = [
+            {'id': meme.id, 'upvote': meme.upvote, 'downvote': meme.downvote, 'userVote': wanted[meme.id]}
+            for meme in sorted(memes, key=lambda meme: meme.id)
+        ]
+        return Response({'results': results, 'missing': missing}, status=status.HTTP_200_OK)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -135,10 +136,62 @@ REST_FRAMEWORK = {
     )
 }
 
+# Response caching for meme detail and feeds, see api/caching.py.
+# Local memory is per process, point this at Redis or Memcached when running several workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'memes',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+}
+
+# AI pipeline admission control, see ai/limits.py
+AI_ADMISSION = {
+    'MAX_CONCURRENT': 4,  # pipelines running at once per process
+    'MAX_QUEUE': 16,  # uploads waiting for a slot before we answer 429
+    'PER_USER': 1,  # uploads in flight per user
+    'QUEUE_TIMEOUT': 30,  # seconds
+}
+
+# upstream: (requests per second, burst) for the whole site.
+# the token buckets are per process, so each worker gets rate / AI_WORKER_PROCESSES,
+# keep AI_WORKER_PROCESSES in sync with the number of gunicorn/uvicorn workers
+AI_WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+AI_RATE_LIMITS = {
+    'docsbot': (4, 8),
+    'deepseek': (2, 4),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+# point MEDIA_ROOT at a shared mount when running several app nodes
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', BASE_DIR / 'media')
+
+# MEDIA_STORAGE=s3 stores media in an S3-compatible bucket through django-storages
+# (pip install django-storages boto3), AWS_S3_ENDPOINT_URL can point at a local MinIO
+if os.getenv('MEDIA_STORAGE') == 's3':
+    STORAGES = {
+        'default': {
+            'BACKEND': 'storages.backends.s3.S3Storage',
+            'OPTIONS': {
+                'bucket_name': os.getenv('AWS_STORAGE_BUCKET_NAME', 'memes'),
+                'endpoint_url': os.getenv('AWS_S3_ENDPOINT_URL'),
+                'access_key': os.getenv('AWS_ACCESS_KEY_ID'),
+                'secret_key': os.getenv('AWS_SECRET_ACCESS_KEY'),
+                # names are content hashes, an existing key already has the same bytes
+                'file_overwrite': True,
+                'querystring_auth': False,
+            },
+        },
+        'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        },
+    }
+
+# threads writing generated images to storage in the background, see api/storage.py
+MEDIA_WRITER_THREADS = 4